@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- encoding: utf-8 -*-
+
+# Benchmarks of the hot paths of CuteView, run headless (on Qt's offscreen platform): rendering
+# a page, turning to a page (rendered, from the disk cache, and from the memory cache), trimming,
+# redrawing at the window's size, resizing, decoding images, and the startup. The files they run on
+# are made here: pages of text, full-bleed scans, and a huge photo. The results are written as JSON,
+# to compare them across versions of CuteView (and of its backends):
+#
+#   python3 bench.py [-o results.json] [-n REPEATS] [--quick] [--only NAME ...]
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+DATA_HOME = tempfile.mkdtemp(prefix='cuteview-bench-')  # and the files; removed at the end
+os.environ['XDG_DATA_HOME'] = DATA_HOME  # not to touch the user's history and caches
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+
+import cuteview
+
+
+# THE FILES
+
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut "
+         "labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco laboris "
+         "nisi ut aliquip ex ea commodo consequat. Duis aute irure dolor in reprehenderit in voluptate. ")
+
+def makePdf(path, pages, draw):
+    writer = QPdfWriter(path)
+    writer.setPageSize(QPageSize(QPageSize.A4))
+    writer.setResolution(300)
+    painter = QPainter(writer)
+    for i in range(pages):
+        if i:
+            writer.newPage()
+        draw(painter, QRect(0, 0, writer.width(), writer.height()), i)
+    painter.end()
+
+def drawText(painter, rect, i):
+    painter.setFont(QFont('Serif', 10))
+    margins = rect.adjusted(300, 300, -300, -300)
+    painter.drawText(margins, Qt.TextWordWrap, f"{i + 1}. " + LOREM * 30)
+
+# a page scanned at 150 dpi: off-white paper with noise, and the text printed on it
+def drawScan(painter, rect, i):
+    (w, h) = (1240, 1754)
+    paper = os.urandom(w * h).translate(bytes(226 + b % 30 for b in range(256)))
+    img = QImage(paper, w, h, w, QImage.Format_Grayscale8).copy()
+    p = QPainter(img)
+    p.setFont(QFont('Serif', 7))
+    drawText(p, QRect(0, 0, w, h).adjusted(-150, -150, 150, 150), i)
+    p.end()
+    painter.drawImage(rect, img)
+
+def makePhoto(path, w, h):
+    img = QImage(w, h, QImage.Format_RGB888)
+    painter = QPainter(img)
+    gradient = QLinearGradient(0, 0, w, h)
+    gradient.setColorAt(0, QColor(30, 80, 160))
+    gradient.setColorAt(1, QColor(240, 200, 90))
+    painter.fillRect(img.rect(), gradient)
+    painter.setFont(QFont('Sans', h // 20))
+    for y in range(0, h, h // 10):
+        painter.drawText(0, y, LOREM)
+    painter.end()
+    img.save(path, quality=90)
+
+def makeFiles(dir, quick):
+    pages = 6 if quick else 20
+    files = {
+        'text': os.path.join(dir, 'text.pdf'),
+        'scan': os.path.join(dir, 'scan.pdf'),
+        'photo': os.path.join(dir, 'photo.jpg'),
+    }
+    makePdf(files['text'], pages, drawText)
+    makePdf(files['scan'], pages, drawScan)
+    makePhoto(files['photo'], *((3000, 2000) if quick else (8000, 6000)))
+    return files
+
+
+# THE TIMING
+
+results = []
+
+# times fn (given the repeat's index) n times, after warm of untimed repeats
+def timeit(name, case, fn, n, warm=1):
+    for i in range(warm):
+        fn(-1 - i)
+    times = []
+    for i in range(n):
+        start = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - start)
+    record(name, case, times)
+
+def record(name, case, times):
+    ms = [t * 1000 for t in times]
+    results.append({'name': name, 'case': case, 'n': len(ms),
+                    'median_ms': round(statistics.median(ms), 3),
+                    'min_ms': round(min(ms), 3), 'max_ms': round(max(ms), 3)})
+    print(f"{name:<24} {case:<28} median {statistics.median(ms):9.2f} ms   min {min(ms):9.2f} ms", flush=True)
+
+def waitFor(condition, timeout=60):
+    end = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > end:
+            raise TimeoutError
+        QCoreApplication.processEvents(QEventLoop.AllEvents, 5)
+
+
+# THE BENCHMARKS
+
+def benchRender(files, n):
+    if cuteview.PdfBackend is None:
+        return
+    for kind in ('text', 'scan'):
+        backend = cuteview.PdfBackend(files[kind])
+        count = backend.info()[1]
+        for longdim in (1024, 2048):
+            timeit('render', f"{kind}, {longdim}", lambda i: backend.render(i % count, longdim), n)
+
+# through Pages, as the viewer turns the pages: until the page is shown at the asked size
+def benchPageTurn(files, n):
+    if cuteview.PdfBackend is None:
+        return
+    longdim = 2048
+    for kind in ('text', 'scan'):
+        pages = cuteview.Pages(files[kind])
+        count = pages.length if pages.counted else cuteview.PdfBackend(files[kind]).info()[1]
+        def turn(i, pages=pages):
+            pages.page = i % count
+            get = pages._Pages__getPdfPage(pages.page, longdim)
+            if get is None or pages.shownDim < longdim:
+                waitFor(lambda: pages.shown == pages.page and pages.shownDim >= longdim)
+        timeit('page turn, rendered', kind, turn, min(n, count), warm=0)
+        timeit('page turn, cached', kind, turn, min(n, count), warm=0)
+        pages.invert = True
+        timeit('page turn, night mode', kind, turn, min(n, count), warm=0)
+        # a new window, on the same file: its memory cache is empty, but the pages are on disk
+        if cuteview.DISK_CACHE_BYTES:
+            pages = cuteview.Pages(files[kind])
+            timeit('page turn, from disk', kind, lambda i: turn(i, pages), min(n, count), warm=0)
+
+def benchTrim(files, n):
+    if cuteview.PdfBackend is None:
+        return
+    for kind in ('text', 'scan'):
+        backend = cuteview.PdfBackend(files[kind])
+        for longdim in (1024, 2048):
+            img = backend.render(0, longdim)
+            timeit('trim', f"{kind}, {longdim}", lambda i: cuteview.cropBox(img), n)
+
+def viewer(pages, size=(1280, 800)):
+    v = cuteview.TouchViewer(pages, setTitle=lambda t: None)
+    v.resize(*size)
+    v.show()
+    waitFor(lambda: v.pix is not None and v.lbl.pixmap() is not None)
+    return v
+
+def benchRedraw(files, n):
+    if cuteview.PdfBackend is not None:
+        v = viewer(cuteview.Pages(files['scan']))
+        redraw = v._TouchViewer__redraw
+        timeit('redraw', 'pdf', lambda i: redraw(), n)
+        v.pages.trim = True
+        timeit('redraw', 'pdf, trimmed', lambda i: redraw(), n)
+        (v.pages.trim, v.pages.invert, v.pages.opacity) = (False, True, 200)
+        timeit('redraw', 'pdf, translucent', lambda i: redraw(), n)
+        # resizing redraws the page as it is, scaled, until it's gotten at the new size
+        sizes = [(1280, 800), (1100, 700)]
+        timeit('resize', 'pdf', lambda i: (v.resize(*sizes[i % 2]), QCoreApplication.sendPostedEvents()), n)
+        v.close()
+    v = viewer(cuteview.Pages(files['photo']))
+    redraw = v._TouchViewer__redraw
+    v.f = 1
+    timeit('redraw', 'image', lambda i: redraw(), n)
+    v.f = 3
+    def pan(i):
+        v.x = (i % 10) * 20
+        redraw()
+    timeit('redraw', 'image, zoomed, panned', pan, n)
+    def zoom(i):
+        v.f = 2 + (i % 2)
+        redraw()
+    timeit('redraw', 'image, zoomed anew', zoom, n)
+    v.close()
+
+def benchDecode(files, n):
+    for longdim in (2048, 10**6):
+        case = 'photo, ' + ('2048' if longdim == 2048 else 'whole')
+        timeit('decode', case, lambda i: cuteview.readImage(files['photo'], longdim), n)
+
+STARTUP = '''
+import json, sys
+sys.path.insert(0, {here!r})
+import cuteview
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+started = cuteview.started
+def stage(name):
+    started(name)
+    if name == 'first page':
+        QTimer.singleShot(0, QApplication.quit)
+cuteview.started = stage
+cuteview.main(['cuteview', {path!r}])
+print(json.dumps(cuteview.startup))
+'''
+
+# in a new process, until the first page is shown: without anything saved (cold), and after
+def benchStartup(files, n):
+    kinds = ['photo'] + (['text'] if cuteview.PdfBackend is not None else [])
+    for kind in kinds:
+        for warm in (False, True):
+            (stages, walls) = ({}, [])
+            for i in range(-1 if warm else 0, n):  # the warm ones after an untimed one
+                home = os.path.join(DATA_HOME, f"startup-{kind}-" + ('warm' if warm else str(i)))
+                os.makedirs(home, exist_ok=True)
+                code = STARTUP.format(here=HERE, path=files[kind])
+                start = time.perf_counter()
+                out = subprocess.run([sys.executable, '-c', code], env=dict(os.environ, XDG_DATA_HOME=home),
+                                     check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+                if i < 0:
+                    continue
+                walls.append(time.perf_counter() - start)
+                for (stage, seconds) in json.loads(out.splitlines()[-1]).items():
+                    stages.setdefault(stage, []).append(seconds)
+            case = f"{kind}, {'warm' if warm else 'cold'}"
+            record('startup, process', case, walls)
+            for (stage, seconds) in stages.items():
+                record('startup, ' + stage, case, seconds)
+
+BENCHMARKS = {
+    'render':    benchRender,
+    'pageturn':  benchPageTurn,
+    'trim':      benchTrim,
+    'redraw':    benchRedraw,
+    'decode':    benchDecode,
+    'startup':   benchStartup,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CuteView, headless.")
+    parser.add_argument('-o', '--output', default='bench-results.json', help="the JSON file of the results")
+    parser.add_argument('-n', '--repeat', type=int, default=10, help="how many times each case is timed")
+    parser.add_argument('--quick', action='store_true', help="smaller files and fewer repeats")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, help="run only these benchmarks")
+    args = parser.parse_args()
+    n = min(args.repeat, 3) if args.quick else args.repeat
+    #
+    app = QApplication(sys.argv[:1])
+    try:
+        files = makeFiles(tempfile.mkdtemp(prefix='files-', dir=DATA_HOME), args.quick)
+        for name in args.only or BENCHMARKS:
+            BENCHMARKS[name](files, n)
+        for pool in cuteview.RenderScheduler.pools.values():
+            pool.waitForDone()
+    finally:
+        shutil.rmtree(DATA_HOME, ignore_errors=True)
+    #
+    with open(args.output, 'w') as f:
+        json.dump({
+            'date': datetime.datetime.now().astimezone().isoformat(timespec='seconds'),
+            'machine': {
+                'platform': platform.platform(),
+                'python': platform.python_version(),
+                'qt': QT_VERSION_STR,
+                'cpus': os.cpu_count(),
+                'threads': cuteview.THREADS,
+                'backend': cuteview.PdfBackend and cuteview.PdfBackend.__name__,
+            },
+            'quick': args.quick,
+            'results': results,
+        }, f, indent=1)
+    print("written to", args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,45 +1,207 @@
 #!/usr/bin/env python3
 # -*- encoding: utf-8 -*-
 
+import time
+STARTED = time.monotonic()  # for timing the startup
+
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
 
+from collections import OrderedDict
 import configparser
+import contextlib
+import sqlite3
+import bisect
+import hashlib
+import json
 import subprocess
-import tempfile
+import re
+import threading
+import math
 import shutil
+import importlib.util
 import sys
 import os
 
 
-poppler = shutil.which('pdfinfo') is not None
-mutool  = shutil.which('mutool')  is not None
-if mutool:
-    render = lambda longdim, invert, outfile, outfile_base, pdfpath, pageidx: [
-        'mutool', 'draw',
-            '-w', str(longdim),
-            '-h', str(longdim),
-            *(['-I', '-c', 'g'] if invert else []),
-            '-o', outfile,
-            pdfpath, str(pageidx + 1),
-        ]
-else:
-    render = lambda longdim, invert, outfile, outfile_base, pdfpath, pageidx: [
-        'pdftoppm', '-singlefile',
-            '-f', str(pageidx + 1),
-            '-scale-to', str(longdim),
-            *(['-gray'] if invert else []),
-            pdfpath,
-            outfile_base,
-        ]
-# mutool can invert, and saves to the gives name (including the extension).
-# pdftoppm cannot invert, but forces the extension it sees fit (e.g., '.pgm' if grayscale).
+# PyMuPDF is only looked for here, and imported when first used (by a render worker), as importing it
+# takes longer than starting the GUI; and the tools are only looked for if it's not found.
+PYMUPDF = next((m for m in ('pymupdf', 'fitz') if importlib.util.find_spec(m)), None)  # fitz before 1.24
+pymupdf = None
+
+poppler = PYMUPDF is None and shutil.which('pdfinfo') is not None
+mutool  = PYMUPDF is None and shutil.which('mutool')  is not None
+
+
+# A PDF backend renders the pages of one PDF file, and tells its title and page count.
+#   render(pageidx, longdim) returns the page as a QImage; it's rendered straight into memory,
+#     not through a file. It may be called from several render workers at once.
+#   info() returns (title or None, page count).
+#   fingerprints(stop) returns a digest of each page's content, or None if it can't tell them (or
+#     the stop event is set, on quitting); it's used on reloading the file, to keep the renders of
+#     the pages that didn't change.
+# Pages are always rendered as they are; the night mode is applied to the rendered page (see nightMode).
+# The backend is chosen by what is installed; a new one is made when the file changes.
+
+def pdfinfo(pdfpath):
+    title = None
+    count = 0
+    for line in subprocess.run(['pdfinfo', pdfpath], capture_output=True).stdout.split(b'\n'):
+        if line.startswith(b'Title:'):
+            title = line.split(None, 1)[1].decode('utf-8')  # it's bytes
+        if line.startswith(b'Pages:'):
+            count = int(line.split()[1])
+    return (title, count)
+
+
+# 8-bit binary PGM (P5) and PPM (P6), which is what mutool and pdftoppm write, are wrapped as they are,
+# with one copy and no decoding; anything else (e.g., with comments in the header) is decoded by Qt.
+PNM_HEADER = re.compile(rb'P([56])\s+(\d+)\s+(\d+)\s+255\s')
+
+def pnmToQImage(data):
+    m = PNM_HEADER.match(data)
+    if not m:
+        return QImage.fromData(data)
+    (w, h) = (int(m[2]), int(m[3]))
+    (fmt, depth) = (QImage.Format_Grayscale8, 1) if m[1] == b'5' else (QImage.Format_RGB888, 3)
+    if len(data) - m.end() < w * h * depth:  # truncated
+        return QImage()
+    # copy, to own the pixels instead of referencing the bytes
+    return QImage(memoryview(data)[m.end():], w, h, w * depth, fmt).copy()
+
+
+# in-process; keeps the document open, so it's parsed once, not on every page.
+class PyMuPdfBackend:
+
+    lock = threading.Lock()  # MuPDF is not thread-safe
+    serial = True  # so its renders are run on a pool of one thread (see RenderScheduler)
+
+    def __init__(self, pdfpath):
+        self.pdfpath = pdfpath
+        self.doc = None
+
+    def __open(self):
+        global pymupdf
+        if pymupdf is None:
+            pymupdf = importlib.import_module(PYMUPDF)
+        if self.doc is None:
+            self.doc = pymupdf.open(self.pdfpath)
+        return self.doc
+
+    # an unreadable file has no pages, as with pdfinfo; an unreadable page is a null image, as with
+    # the other backends.
+    def info(self):
+        with self.lock:
+            try:
+                doc = self.__open()
+                return (doc.metadata.get('title') or None, doc.page_count)
+            except Exception as e:
+                print("Cannot read {}: {}".format(self.pdfpath, e), file=sys.stderr)
+                return (None, 0)
+
+    def render(self, pageidx, longdim):
+        with self.lock:
+            try:
+                doc = self.__open()
+                if pageidx >= doc.page_count:  # e.g., before the page count is known
+                    return QImage()
+                page = doc[pageidx]
+                zoom = longdim / max(page.rect.width, page.rect.height)
+                pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+            except Exception:
+                return QImage()
+            # copy, as the samples are freed with the pixmap
+            return QImage(pix.samples_mv, pix.width, pix.height, pix.stride, QImage.Format_RGB888).copy()
+
+    # of what a page draws: its size, content stream, images, forms, fonts, and annotations; the lock
+    # is taken for a page at a time, to not hold the renders for the whole file.
+    def fingerprints(self, stop):
+        with self.lock:
+            try:
+                count = self.__open().page_count
+            except Exception:
+                return None  # unknown, as with the other backends
+        prints = []
+        for pageidx in range(count):
+            if stop.is_set():
+                return None
+            with self.lock:
+                doc = self.__open()
+                page = doc[pageidx]
+                h = hashlib.sha1(repr((tuple(page.rect), page.rotation)).encode())
+                h.update(page.read_contents())
+                for xref in [img[0] for img in page.get_images(full=True)] + \
+                            [form[0] for form in page.get_xobjects()]:
+                    h.update(doc.xref_stream_raw(xref) or b'')
+                for font in page.get_fonts(full=True):
+                    h.update(font[3].encode('utf-8', 'surrogateescape'))  # the name has the subset tag
+                for annot in page.annot_xrefs():
+                    h.update(doc.xref_object(annot[0], compressed=True).encode('utf-8', 'surrogateescape'))
+                prints.append(h.digest())
+        return prints
+
+
+class SubprocessBackend:
+
+    serial = False
+
+    def __init__(self, pdfpath):
+        self.pdfpath = pdfpath
+
+    def info(self):
+        return pdfinfo(self.pdfpath)
+
+    def fingerprints(self, stop):
+        return None  # so every page is rendered anew
+
+    def render(self, pageidx, longdim):
+        with span('subprocess', pageidx):
+            out = subprocess.run(self.command(pageidx, longdim),
+                                 stderr=subprocess.DEVNULL, stdout=subprocess.PIPE).stdout
+        with span('decode', pageidx):
+            return pnmToQImage(out)
+
+
+# mutool writes to stdout when given '-' as the output file.
+class MutoolBackend(SubprocessBackend):
+
+    def command(self, pageidx, longdim):
+        return [
+            'mutool', 'draw',
+                '-w', str(longdim),
+                '-h', str(longdim),
+                '-F', 'pnm',
+                '-o', '-',
+                self.pdfpath, str(pageidx + 1),
+            ]
+
+
+# pdftoppm writes to stdout when not given an output file.
+class PdftoppmBackend(SubprocessBackend):
+
+    def command(self, pageidx, longdim):
+        return [
+            'pdftoppm', '-singlefile',
+                '-f', str(pageidx + 1),
+                '-scale-to', str(longdim),
+                self.pdfpath,
+            ]
+
+
+# pdfinfo is needed by both subprocess backends
+PdfBackend = (PyMuPdfBackend  if PYMUPDF else
+              MutoolBackend   if poppler and mutool else
+              PdftoppmBackend if poppler else
+              None)
 
 
 # (XDG_DATA_HOME || ~/.local/share) + ./cuteview
 DATA_DIR = os.path.join(os.environ.get("XDG_DATA_HOME", os.path.expanduser("~/.local/share")), "cuteview")
-HIST_INI = os.path.join(DATA_DIR, 'history')
+HIST_INI = os.path.join(DATA_DIR, 'history')  # the old history; migrated into HIST_DB
+HIST_DB = os.path.join(DATA_DIR, 'history.sqlite3')
+CROPS_DIR = os.path.join(DATA_DIR, 'crops')
+DISK_CACHE_DIR = os.path.join(DATA_DIR, 'pages')
 
 if not os.path.exists(DATA_DIR):
     os.mkdir(DATA_DIR)
@@ -47,89 +209,1016 @@ if not os.path.exists(DATA_DIR):
 
 DEFAULT_INVERT = False
 DEFAULT_TRIM   = False
+TRIM_TOLERANCE = 32  # how far from the margin color (in grayscale, 0-255) a pixel can be and still be margin
 (MIN_OPACITY, STEP_OPACITY, DEFAULT_OPACITY, MAX_OPACITY) = (0, 5, 255, 255)
 
+# the memory for the rendered pages (or the decoded images) of all of the windows, shared; the least
+# recently used are dropped beyond it.
+CACHE_BYTES = int(os.environ.get('CUTEVIEW_CACHE_MB', 256)) * 2**20
+
+# the disk space for the rendered pages of all PDFs, kept between sessions; 0 disables it.
+DISK_CACHE_BYTES = int(os.environ.get('CUTEVIEW_DISK_CACHE_MB', 512)) * 2**20
+
+# how many pages can be rendered at once (default: a page per core), and how many pages ahead can be
+# prefetched (see Prefetcher; 0 disables prefetching).
+THREADS = int(os.environ.get('CUTEVIEW_THREADS', 0)) or QThread.idealThreadCount()
+PREFETCH_MAX = int(os.environ.get('CUTEVIEW_PREFETCH', 4))
+
+# set CUTEVIEW_STATS to have the statistics (e.g., of the page cache) printed to stderr on exit.
+STATS = bool(os.environ.get('CUTEVIEW_STATS'))
+
+def report(what, stats):
+    if STATS:
+        print(f"cuteview: {what}: " + ", ".join(f"{k}={v}" for (k, v) in stats.items()), file=sys.stderr)
+
+# the seconds since the start, at which each stage of the startup is reached; reported when the
+# first page is shown.
+startup = {}
+
+def started(stage):
+    if stage not in startup:
+        startup[stage] = round(time.monotonic() - STARTED, 3)
+        if stage == 'first page':
+            report('startup (seconds)', startup)
+
+# Tracing: the time of each stage of getting a page on the screen (rendering, decoding, loading from and
+# saving to the disk cache, trimming, the night mode, scaling, masking), on whichever thread, and for each
+# frame drawn, the stages of the GUI thread since the last frame, and those of the render job it shows (if
+# it's drawn as the job is delivered, rather than from the cache), with the counters of the caches, the
+# depth of the render queue, and the memory used. It's written to CUTEVIEW_TRACE (or --trace=FILE), as JSON lines;
+# or as a Chrome trace (for chrome://tracing or Perfetto) if it ends with .json. CUTEVIEW_OVERLAY (or
+# --overlay) shows the last frame's stages on the window. It costs nothing when off.
+class Trace:
+
+    def __init__(self, path=None, overlay=False):
+        self.overlay = overlay
+        self.lock = threading.Lock()  # the stages are recorded from the render workers too
+        self.stages = {}  # render job (or None, for the GUI thread) -> {stage: seconds}
+        self.local = threading.local()  # .job: the render job running on this thread
+        self.delivered = None  # the render job whose result is being delivered, on the GUI thread
+        self.last = {}  # the stages of the last frame
+        self.file = open(path, 'w') if path else None
+        self.chrome = path is not None and path.endswith('.json')
+        if self.chrome:
+            self.file.write('[\n')  # the closing bracket is optional
+        if self.file:
+            QCoreApplication.instance().aboutToQuit.connect(self.close)
+
+    @contextlib.contextmanager
+    def span(self, stage, page=None):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            with self.lock:
+                stages = self.stages.setdefault(getattr(self.local, 'job', None), {})
+                stages[stage] = stages.get(stage, 0) + (end - start)
+                self.__write(stage, start, end - start, {'page': page} if page is not None else {})
+
+    # the spans of a render worker while it runs job are recorded as the job's
+    @contextlib.contextmanager
+    def running(self, job):
+        self.local.job = job
+        try:
+            yield
+        finally:
+            self.local.job = None
+
+    # a frame drawn while job's result is delivered shows the job's stages; they're dropped after, as
+    # a page shown later is shown from the cache, and the job's stages are then no part of its frame.
+    @contextlib.contextmanager
+    def delivering(self, job):
+        self.delivered = job
+        try:
+            yield
+        finally:
+            self.delivered = None
+            with self.lock:
+                self.stages.pop(job, None)
+
+    # the stages of the GUI thread since the last frame, and of the job being delivered, if any
+    def frame(self, page, counters):
+        now = time.monotonic()
+        with self.lock:
+            job = self.stages.pop(self.delivered, {}) if self.delivered is not None else {}
+            self.last = {**job, **self.stages.pop(None, {})}
+            self.__write('frame', now, 0, {'page': page,
+                    'stages_ms': {k: round(v * 1000, 3) for (k, v) in self.last.items()}, **counters})
+
+    def __write(self, name, start, seconds, args):
+        if self.file is None:
+            return
+        tid = threading.get_native_id()
+        if self.chrome:
+            event = {'name': name, 'ph': 'X' if seconds else 'i', 'ts': round((start - STARTED) * 1e6),
+                     'dur': round(seconds * 1e6), 'pid': os.getpid(), 'tid': tid, 'args': args}
+            self.file.write(json.dumps(event, default=str) + ',\n')
+        else:
+            event = {'name': name, 't': round(start - STARTED, 6), 'ms': round(seconds * 1000, 3),
+                     'thread': tid, **args}
+            self.file.write(json.dumps(event, default=str) + '\n')
+
+    def close(self):
+        with self.lock:
+            if self.chrome:
+                self.file.write('{}]\n')
+            self.file.close()
+            self.file = None
+
+TRACE = None
+
+def startTrace(path, overlay):
+    global TRACE
+    if path or overlay:
+        TRACE = Trace(path, overlay)
+
+def span(stage, page=None):
+    return TRACE.span(stage, page) if TRACE else contextlib.nullcontext()
+
+# the memory of the process, in bytes
+def rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+# The margins are the lines (rows or columns) from each edge up to the middle whose pixels are all
+# the color of the corners, give or take tolerance (for the noise in scans). The image is scanned
+# in bulk, in grayscale: its buffer is mapped through a table to 1 for content and 0 for background,
+# and a row is blank if it has no 1s; columns are the rows of the image rotated.
+def boundingRectRatio(p, vmargin=0, hmargin=0, tolerance=TRIM_TOLERANCE):
+    img = QImage(p).convertToFormat(QImage.Format_Grayscale8)
+    (w, h) = (img.width(), img.height())
+    if w == 0: return
+    #
+    def pixels(img):
+        return img.constBits().asstring(img.sizeInBytes())
+    data = pixels(img)
+    bpl = img.bytesPerLine()
+    bg = data[0]
+    if any(abs(data[i] - bg) > tolerance for i in (w-1, (h-1)*bpl, (h-1)*bpl + w-1)): return
+    content = bytes(abs(v - bg) > tolerance for v in range(256))
+    #
+    def blankrows(img):
+        (w, bpl) = (img.width(), img.bytesPerLine())
+        mask = pixels(img).translate(content)
+        return [mask.count(1, y*bpl, y*bpl + w) == 0 for y in range(img.height())]
+    #
+    def chk(blank, default, range1):
+        ret = default
+        for i in range1:
+            if not blank[i]: break
+            else: ret = i
+        return ret
+    #
+    rows = blankrows(img)
+    top    = chk(rows, -1, range(     h//2    ))
+    bottom = chk(rows,  h, range(h-1, h//2, -1))
+    # rotating by 90 degrees clockwise makes column x into row x
+    cols = blankrows(img.copy(0, top+1, w, bottom-top-1).transformed(QTransform().rotate(90)))
+    left   = chk(cols, -1, range(     w//2    ))
+    right  = chk(cols,  w, range(w-1, w//2, -1))
+    #
+    top    = max( top    - vmargin,  -1 )
+    bottom = min( bottom + vmargin,   h )
+    left   = max( left   - hmargin,  -1 )
+    right  = min( right  + hmargin,   w )
+    #
+    X = (left   + 1)
+    Y = (top    + 1)
+    W = (right  - X)
+    H = (bottom - Y)
+    # return QPixmap(img.copy(X, Y, W, H))
+    return tuple(e/w for e in (X, Y, W, H))
+
+
+# Reads an image no bigger than longdim (its longer side), and tells whether it's whole (i.e., not
+# scaled down). Scaling on reading lets decoders that can (e.g., JPEG) decode fewer pixels to begin with.
+# thread-safe; used by the render workers.
+def readImage(path, longdim):
+    # https://doc.qt.io/qt-5/qtwidgets-widgets-imageviewer-example.html
+    reader = QImageReader(path)
+    reader.setAutoTransform(True)
+    size = reader.size()  # before the transformation; but only the longer side matters
+    whole = not size.isValid() or max(size.width(), size.height()) <= longdim
+    if not whole:
+        reader.setScaledSize(size.scaled(longdim, longdim, Qt.KeepAspectRatio))
+    newimg = reader.read()
+    if newimg == QImage():
+        # TODO: show this error msg on the window
+        print("Cannot load {}: {}".format(
+            QDir.toNativeSeparators(path), reader.errorString()), file=sys.stderr)
+    return (newimg, whole)
+
+
+# The night mode of a rendered page: grayscale, inverted. Both are done by Qt, in bulk; so it's quick
+# enough to do on every showing of a page, and only the pages as they are need to be rendered and cached.
+def nightMode(img):
+    img = img.convertToFormat(QImage.Format_Grayscale8)
+    img.invertPixels()
+    return img
+
+
+# The auto-crop rectangle of a rendered page, as fractions of its width; None if its margins are
+# not of one color. It's found on a quarter-size thumbnail, which is faster and blurs away finer noise.
+def cropBox(img):
+    small = img.scaled(img.width()//4, img.height()//4, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return boundingRectRatio(small, vmargin=20, hmargin=10)
+
+
+# The crop boxes of the pages of a PDF file, saved between sessions (like the history), so they're
+# computed once for each revision of the file; a revision is identified by the file's size and mtime.
+# They're saved as of the revision they were found for, which may not be the file's by then.
+class CropBoxes:
+
+    def __init__(self, pdfpath, rev):
+        self.pdfpath = pdfpath
+        self.revision = rev  # None if the file can't be read; then they're not saved
+        name = hashlib.sha1(os.path.abspath(pdfpath).encode('utf-8', 'surrogateescape')).hexdigest()
+        self.file = os.path.join(CROPS_DIR, name + '.json')
+        self.boxes = {}  # pageidx -> crop box or None
+        self.dirty = False
+        try:
+            with open(self.file) as f:
+                saved = json.load(f)
+            if rev is not None and saved['revision'] == list(rev):
+                self.boxes = {int(k): v and tuple(v) for (k, v) in saved['boxes'].items()}
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def __contains__(self, pageidx): return pageidx in self.boxes
+    def __getitem__(self, pageidx):  return self.boxes[pageidx]
+
+    def __setitem__(self, pageidx, box):
+        self.boxes[pageidx] = box
+        self.dirty = True
+
+    # when the file changes to rev; the boxes of the kept pages are still good
+    def invalidate(self, rev, keep=()):
+        self.revision = rev
+        self.boxes = {pageidx: box for (pageidx, box) in self.boxes.items() if pageidx in keep}
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty or self.revision is None:
+            return
+        try:
+            os.makedirs(CROPS_DIR, exist_ok=True)
+            with open(self.file, 'w') as f:
+                json.dump({'revision': list(self.revision), 'boxes': self.boxes}, f)
+            self.dirty = False
+        except OSError:
+            pass  # it's only a cache
+
+
+# The position and preferences of each PDF (by its absolute path), and any metadata worth keeping
+# about it (as JSON), in SQLite: a row is read or written by its key alone, and the write-ahead log
+# lets several CuteViews read and write at once. A column is NULL if it's the default.
+class History:
+
+    FIELDS = ('page', 'invert', 'trim', 'opacity')
+
+    def __init__(self):
+        self.db = sqlite3.connect(HIST_DB, timeout=10, isolation_level=None)  # autocommit
+        self.db.execute('PRAGMA journal_mode=WAL')
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            new = not self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'docs'").fetchone()
+            self.db.execute('CREATE TABLE IF NOT EXISTS docs (path TEXT PRIMARY KEY, '
+                            'page INTEGER, invert INTEGER, trim INTEGER, opacity INTEGER, meta TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS migrated (path TEXT PRIMARY KEY, '
+                            'page INTEGER, invert INTEGER, trim INTEGER, opacity INTEGER)')
+            if new:
+                self.__migrate()
+
+    def __migrate(self):
+        config = configparser.RawConfigParser(empty_lines_in_values=False)
+        config.read(HIST_INI)
+        for path in config.sections():
+            this = config[path]
+            self.db.execute('INSERT OR IGNORE INTO migrated VALUES (?, ?, ?, ?, ?)', (path,
+                    this.getint('page'), this.getboolean('invert'), this.getboolean('trim'),
+                    this.getint('opacity')))
+
+    # the INI's sections were named by the paths with these replaced, which can't be undone; so the
+    # migrated rows are kept apart, by their mangled paths, until they're saved again under the real
+    # ones (when they're moved, see __adopt). Only they are looked up by a mangled path, as the real
+    # path of another PDF may be the same.
+    @staticmethod
+    def __iniKey(path):
+        return path.replace('[', '_').replace(']', '_').replace('\n', '_')
+
+    # returns a dict of the saved fields
+    def get(self, path):
+        row = self.__row(path) or self.__row(self.__iniKey(path), 'migrated')
+        fields = dict(zip(self.FIELDS, row or ()))
+        for b in ('invert', 'trim'):
+            if fields.get(b) is not None:
+                fields[b] = bool(fields[b])
+        return {k: v for (k, v) in fields.items() if v is not None}
+
+    def __row(self, path, table='docs'):
+        return self.db.execute(f'SELECT page, invert, trim, opacity FROM {table} WHERE path = ?',
+                               (path,)).fetchone()
+
+    # takes a dict of the fields to save; the others are saved as defaults
+    def put(self, path, fields):
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.__adopt(path)
+            self.db.execute('INSERT INTO docs (path, page, invert, trim, opacity) VALUES (?, ?, ?, ?, ?) '
+                            'ON CONFLICT (path) DO UPDATE SET page = excluded.page, '
+                            'invert = excluded.invert, trim = excluded.trim, opacity = excluded.opacity',
+                            (path, *(fields.get(k) for k in self.FIELDS)))
+            self.__prune(path)
+
+    def meta(self, path):
+        row = self.db.execute('SELECT meta FROM docs WHERE path = ?', (path,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def setMeta(self, path, meta):
+        with self.db:
+            self.db.execute('BEGIN IMMEDIATE')
+            self.__adopt(path)
+            self.db.execute('INSERT INTO docs (path, meta) VALUES (?, ?) '
+                            'ON CONFLICT (path) DO UPDATE SET meta = excluded.meta',
+                            (path, json.dumps(meta) if meta else None))
+            self.__prune(path)
+
+    # the migrated row of path, if any, is moved to its real path (unless it has one already), so the
+    # fields that aren't written now are kept, and no stale row is left behind.
+    def __adopt(self, path):
+        old = self.__iniKey(path)
+        self.db.execute('INSERT OR IGNORE INTO docs SELECT ?, page, invert, trim, opacity, NULL '
+                        'FROM migrated WHERE path = ?', (path, old))
+        self.db.execute('DELETE FROM migrated WHERE path = ?', (old,))
+
+    # there's no row for a PDF with nothing to save
+    def __prune(self, path):
+        self.db.execute('DELETE FROM docs WHERE path = ? AND page IS NULL AND invert IS NULL '
+                        'AND trim IS NULL AND opacity IS NULL AND meta IS NULL', (path,))
+
+
+# Renders run on a thread pool, never on the GUI thread. Every job has a key (any hashable
+# describing what it renders) and a priority; the result is delivered back on the GUI thread
+# through the `done` signal. Jobs that are still queued can be cancelled when they become stale.
+# Each window has a scheduler, but they all share one pool, of a thread per core; and the jobs of
+# the focused window are raised by PRIORITY_FOCUSED, to come before all of the others'. Saving
+# the rendered pages to disk comes after everything else. A backend that renders a page at a time
+# has its renders on a pool of one thread, shared too: with more, the idle threads would take the
+# queued jobs right away (where they can't be cancelled, nor overtaken by the visible page) and
+# then wait for each other in no set order.
+PRIORITY_PREVIEW  = 2
+PRIORITY_VISIBLE  = 1
+PRIORITY_PREFETCH = 0
+PRIORITY_SAVE     = -1
+PRIORITY_FOCUSED  = 3
+
+# On turning to a page that's not rendered, if rendering takes longer than PREVIEW_AFTER seconds,
+# a preview at PREVIEW_SCALE of the size is rendered first, and shown until the page is rendered in full.
+PREVIEW_AFTER = 0.15
+PREVIEW_SCALE = 1/4
+
+# Pages are rendered at these sizes (longdim), each rounded up to the next one, so that the small changes
+# of resizing the window don't re-render; beyond the last, to a multiple of it.
+RENDER_SIZES = (256, 384, 512, 768, 1024, 1536, 2048, 3072, 4096)
+
+def renderSize(longdim):
+    for size in RENDER_SIZES:
+        if longdim <= size:
+            return size
+    return -(-longdim // RENDER_SIZES[-1]) * RENDER_SIZES[-1]
+
+# and only after the window stops being resized for this long; meanwhile, the page is scaled.
+RESIZE_DELAY_MS = 150
+
+
+class RenderJob(QRunnable):
+
+    def __init__(self, finished, key, work):
+        super().__init__()
+        self.setAutoDelete(False)  # the scheduler keeps it, to be able to cancel it
+        self.finished = finished
+        self.key = key
+        self.work = work
+        self.started = False
+
+    # a failed job is reported with None as its result, as it has to be reported to be done
+    def run(self):
+        self.started = True
+        try:
+            with TRACE.running(self) if TRACE else contextlib.nullcontext():
+                result = self.work()
+        except Exception as e:
+            print("cuteview: {}: {}".format(type(e).__name__, e), file=sys.stderr)
+            result = None
+        self.finished.emit(self.key, result)
+
+
+class RenderScheduler(QObject):
+
+    done = pyqtSignal(object, object)       # (key, result); on the GUI thread
+    __finished = pyqtSignal(object, object) # (key, result); emitted from the worker threads
+
+    pools = {}      # threads -> pool; shared by all of the schedulers of as many threads
+    focused = None  # the scheduler of the focused window
+    schedulers = [] # all of them, to be shut down at once
+
+    def __init__(self, threads=THREADS):
+        super().__init__()
+        threads = max(1, threads)
+        if not RenderScheduler.pools:
+            QCoreApplication.instance().aboutToQuit.connect(RenderScheduler.shutdown)
+        if threads not in RenderScheduler.pools:
+            RenderScheduler.pools[threads] = QThreadPool()
+            RenderScheduler.pools[threads].setMaxThreadCount(threads)
+        self.pool = RenderScheduler.pools[threads]
+        RenderScheduler.schedulers.append(self)
+        self.jobs = {}  # key -> [job, priority]
+        self.__finished.connect(self.__onFinished)  # queued, as it's emitted from other threads
+
+    def __poolPriority(self, priority):
+        return priority + (PRIORITY_FOCUSED if self is RenderScheduler.focused else 0)
+
+    def submit(self, key, work, priority):
+        if key in self.jobs:
+            (job, oldpriority) = self.jobs[key]
+            # requeue with the higher priority, unless it's already running
+            if priority > oldpriority and self.pool.tryTake(job):
+                self.pool.start(job, self.__poolPriority(priority))
+                self.jobs[key][1] = priority
+            return
+        job = RenderJob(self.__finished, key, work)
+        self.jobs[key] = [job, priority]
+        self.pool.start(job, self.__poolPriority(priority))
+
+    # when its window is focused; the queued jobs of this and the previously focused one are requeued
+    def focus(self):
+        (old, RenderScheduler.focused) = (RenderScheduler.focused, self)
+        for scheduler in {old, self} - {None}:
+            for (job, priority) in scheduler.jobs.values():
+                if scheduler.pool.tryTake(job):
+                    scheduler.pool.start(job, scheduler.__poolPriority(priority))
+
+    def running(self, key):
+        return key in self.jobs and self.jobs[key][0].started
+
+    # returns the keys of the cancelled jobs
+    def cancel(self, keep=lambda key: False):
+        # only the queued jobs can be cancelled; the running ones finish and report normally.
+        cancelled = [key for (key, (job, _)) in list(self.jobs.items()) if not keep(key) and self.pool.tryTake(job)]
+        for key in cancelled:
+            del self.jobs[key]
+        return cancelled
+
+    # on quitting: the queued jobs of all of the windows (and their disk saves) are cancelled first,
+    # then only the running ones are waited for.
+    @staticmethod
+    def shutdown():
+        for scheduler in RenderScheduler.schedulers:
+            scheduler.cancel()
+        for pool in RenderScheduler.pools.values():
+            pool.waitForDone()
+
+    def __onFinished(self, key, result):
+        (job, _) = self.jobs.pop(key, (None, None))
+        with TRACE.delivering(job) if TRACE and job else contextlib.nullcontext():
+            self.done.emit(key, result)
+
+
+# Decoded pages, keyed by (pageidx, longdim), in LRU order. Each window has a cache, but they share
+# one budget of bytes: beyond it, the least recently used page of all of them is dropped.
+# A page rendered bigger than asked for is as good as one of the asked size, so get returns
+# the smallest one that's big enough; and when a bigger one is put, the smaller ones are dropped.
+class PageCache:
+
+    budget = CACHE_BYTES
+    total = 0       # the bytes of all of the caches
+    caches = []
+    clock = 0       # counts the uses of all of the caches, to compare their LRU pages
+
+    def __init__(self):
+        self.bytes = 0
+        self.images = OrderedDict()  # key -> QImage; least recently used first
+        self.used = {}  # key -> clock when last used
+        (self.hits, self.misses, self.evictions) = (0, 0, 0)
+        PageCache.caches.append(self)
+
+    def __use(self, key):
+        self.images.move_to_end(key)
+        PageCache.clock += 1
+        self.used[key] = PageCache.clock
+
+    def get(self, pageidx, longdim):
+        fits = [key for key in self.images if key[0] == pageidx and key[1] >= longdim]
+        if not fits:
+            self.misses += 1
+            return None
+        self.hits += 1
+        key = min(fits)
+        self.__use(key)
+        return self.images[key]
+
+    def put(self, key, img):
+        (pageidx, longdim) = key
+        for old in [k for k in self.images if k[0] == pageidx and k[1] <= longdim]:
+            self.__drop(old)
+        self.images[key] = img
+        self.bytes += img.sizeInBytes()
+        PageCache.total += img.sizeInBytes()
+        self.__use(key)
+        while PageCache.total > self.budget:
+            lru = min((c for c in self.caches if c.images), key=lambda c: c.used[next(iter(c.images))])
+            if lru is self and len(self.images) == 1:  # but always keep the newest
+                break
+            lru.__drop(next(iter(lru.images)))
+            lru.evictions += 1
+
+    # the biggest of a page (even if smaller than wanted), as (longdim, QImage); doesn't count as a use
+    def biggest(self, pageidx):
+        return max(((k[1], img) for (k, img) in self.images.items() if k[0] == pageidx),
+                   key=lambda e: e[0], default=(None, None))
+
+    def clear(self, keep=()):
+        for key in [k for k in self.images if k[0] not in keep]:
+            self.__drop(key)
+
+    def __drop(self, key):
+        size = self.images.pop(key).sizeInBytes()
+        del self.used[key]
+        self.bytes -= size
+        PageCache.total -= size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'pages': len(self.images), 'bytes': self.bytes, 'budget': self.budget}
+
+
+# Which pages to prefetch: ahead in the reading direction (of the last turn), as many as are turned in
+# PREFETCH_HORIZON seconds at the recent pace, from 1 (e.g., when reading a page at a time) to
+# PREFETCH_MAX (e.g., when flipping through slides); and no more than fit in half of the memory budget.
+# It also counts how many prefetched pages were shown (saving a render), how many were turned to before
+# they were ready, and how many were rendered for nothing.
+PREFETCH_HORIZON = 1.0
+
+class Prefetcher:
+
+    def __init__(self):
+        self.direction = 1
+        self.interval = None  # between turns, averaged; None until two turns in the same direction
+        self.last = None  # the time of the last turn
+        self.pending = set()  # the ids of the pages being prefetched
+        self.ready = set()  # and of those prefetched, but not shown yet
+        (self.prefetched, self.saved, self.late) = (0, 0, 0)
+
+    def turned(self, step):
+        now = time.monotonic()
+        direction = 1 if step > 0 else -1
+        if direction != self.direction:
+            (self.direction, self.interval) = (direction, None)
+        elif self.last is not None:
+            gap = now - self.last
+            self.interval = gap if self.interval is None else (self.interval + gap) / 2
+        self.last = now
+
+    # how many pages ahead to prefetch, of at most longdim
+    def ahead(self, longdim):
+        if PREFETCH_MAX <= 0:
+            return 0
+        n = 1 if self.interval is None else math.ceil(PREFETCH_HORIZON / max(self.interval, 0.01))
+        fit = PageCache.budget // 2 // max(1, 4 * longdim * longdim)  # at 4 bytes per pixel
+        return max(1, min(n, fit, PREFETCH_MAX))
+
+    def submitted(self, id):
+        self.pending.add(id)
+
+    def cancelled(self, ids):
+        self.pending.difference_update(ids)
+
+    def rendered(self, id):
+        if id in self.pending:
+            self.pending.remove(id)
+            self.ready.add(id)
+            self.prefetched += 1
+
+    def shown(self, id, cached):
+        if id in self.ready:
+            self.ready.remove(id)
+            self.saved += cached  # otherwise it's been dropped from the cache since
+        elif id in self.pending:
+            self.pending.remove(id)  # it's now rendered as the current page
+            self.late += 1
+
+    def stats(self):
+        return {'prefetched': self.prefetched, 'saved': self.saved, 'late': self.late,
+                'unused': self.prefetched - self.saved}
+
+
+# Rendered pages saved as PNG between sessions, so reopening a PDF shows its last page without
+# rendering it. Each revision of each PDF (by its path, size, and mtime) has a directory, with a file
+# for each (pageidx, longdim). Beyond the budget, the least recently used files of all PDFs are
+# deleted, as soon as a save goes over it (down to EVICT_TO of it, to not do it on every save), and
+# on exit; a file is "used" when it's saved or loaded, which sets its mtime.
+class DiskCache:
+
+    NAME = re.compile(r'(\d+)-(\d+)\.png')
+    EVICT_TO = 3/4
+    lock = threading.Lock()  # the saves run on several threads
+    total = None  # the bytes of the saved pages of all PDFs; found by the first save, then kept up
+
+    def __init__(self, pdfpath):
+        self.enabled = DISK_CACHE_BYTES > 0
+        self.index = {}  # pageidx -> set of longdims; only changed on the GUI thread
+        (self.hits, self.misses) = (0, 0)
+        try:
+            st = os.stat(pdfpath)
+            ident = '\0'.join([os.path.abspath(pdfpath), str(st.st_size), str(st.st_mtime_ns)])
+            self.dir = os.path.join(DISK_CACHE_DIR,
+                    hashlib.sha1(ident.encode('utf-8', 'surrogateescape')).hexdigest())
+            if self.enabled and os.path.isdir(self.dir):
+                for entry in os.scandir(self.dir):
+                    m = self.NAME.fullmatch(entry.name)
+                    if m:
+                        self.add(int(m[1]), int(m[2]))
+        except OSError:
+            self.enabled = False
+
+    def __path(self, pageidx, longdim):
+        return os.path.join(self.dir, f"{pageidx}-{longdim}.png")
+
+    def add(self, pageidx, longdim):
+        self.index.setdefault(pageidx, set()).add(longdim)
+
+    # returns the longdim of the smallest saved page that's big enough, or None
+    def find(self, pageidx, longdim):
+        fits = [d for d in self.index.get(pageidx, ()) if d >= longdim]
+        if not fits:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return min(fits)
+
+    # load and save are called by the render workers
+
+    def load(self, pageidx, longdim):
+        path = self.__path(pageidx, longdim)
+        img = QImage(path)  # null if it's been deleted meanwhile (e.g., by another CuteView)
+        if not img.isNull():
+            try: os.utime(path)
+            except OSError: pass
+        return img
+
+    def save(self, pageidx, longdim, img):
+        if not self.enabled:
+            return False
+        path = self.__path(pageidx, longdim)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.dir, exist_ok=True)
+            # at zlib's level 1: a text page of 2048 is ~40 KB instead of ~8 MB, and loads faster
+            # than uncompressed; higher levels barely make it smaller but take longer to save.
+            if img.save(tmp, 'PNG', 80):
+                size = os.path.getsize(tmp)
+                os.replace(tmp, path)  # atomically, as other CuteViews may be reading it
+                self.__grow(size)
+                return True
+        except OSError:
+            pass
+        return False
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'pages': sum(len(dims) for dims in self.index.values())}
+
+    # the cache of the file's new revision, with the saved kept pages moved into it
+    def renew(self, pdfpath, keep):
+        new = DiskCache(pdfpath)
+        if new.enabled:
+            for pageidx in keep:
+                for longdim in self.index.get(pageidx, ()):
+                    try:
+                        os.makedirs(new.dir, exist_ok=True)
+                        os.replace(self.__path(pageidx, longdim), new.__path(pageidx, longdim))
+                        new.add(pageidx, longdim)
+                    except OSError:
+                        pass
+        return new
+
+    @classmethod
+    def __grow(cls, size):
+        with cls.lock:
+            if cls.total is None:
+                cls.total = cls.evict(math.inf)  # only counts them
+            else:
+                cls.total += size
+            if cls.total is not None and cls.total > DISK_CACHE_BYTES:
+                cls.total = cls.evict(int(DISK_CACHE_BYTES * cls.EVICT_TO))
+
+    # returns the bytes left, or None if they can't be listed
+    @staticmethod
+    def evict(budget=DISK_CACHE_BYTES):
+        files = []  # (mtime, size, path)
+        try:
+            for d in os.scandir(DISK_CACHE_DIR):
+                for f in os.scandir(d.path):
+                    try:
+                        st = f.stat()
+                    except OSError:  # e.g., deleted meanwhile, by another CuteView
+                        continue
+                    files.append((st.st_mtime, st.st_size, f.path))
+        except OSError:
+            return None
+        total = sum(size for (_, size, _) in files)
+        for (_, size, path) in sorted(files):
+            if total <= budget:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+        for d in os.scandir(DISK_CACHE_DIR):
+            try: os.rmdir(d.path)  # if empty
+            except OSError: pass
+        return total
+
+
+# How the images are ordered, by their name and a (cached) stat function: --sort=name|size|mtime.
+IMAGE_SORTS = {
+    'name':  lambda name, stat: name,
+    'size':  lambda name, stat: stat().st_size,
+    'mtime': lambda name, stat: stat().st_mtime,
+}
+
+# a file that can't be stat'ed (e.g., it's gone) is sorted first, and reported when it's shown
+def imageKey(key, name, stat):
+    try:
+        return key(name, stat)
+    except OSError:
+        return -1
+
+# The paths of the images, in order. A list of them is taken as given (or sorted if a sort is given);
+# a single image is listed first, and the rest of its directory (without sub-directories) is found by a
+# scan in the background, and merged in as it comes; so the first image is shown without waiting for
+# the directory, however big. The files are picked by their extensions, without reading them; and the
+# sort keys come from the scan's own stat (which costs nothing to sort by name).
+class ImageIndex(QObject):
+
+    grown = pyqtSignal(object)  # a function mapping an old index to the new one
+    __chunk = pyqtSignal(list)  # from the scan
+
+    def __init__(self, paths, sort=None):
+        super().__init__()
+        if len(paths) > 1:
+            if sort is None:
+                self.items = list(enumerate(paths))  # (key, path)
+            else:
+                key = IMAGE_SORTS[sort]
+                self.items = sorted((imageKey(key, os.path.basename(p), lambda: os.stat(p)), p) for p in paths)
+            return
+        path = paths[0]
+        key = IMAGE_SORTS[sort or 'name']
+        self.items = [(imageKey(key, os.path.basename(path), lambda: os.stat(path)), path)]
+        self.__chunk.connect(self.__merge)
+        exts = {bytes(f).decode() for f in QImageReader.supportedImageFormats()}
+        self.quitting = threading.Event()
+        self.scan = threading.Thread(target=self.__scan, args=(path, key, exts), daemon=True)
+        self.scan.start()
+        QCoreApplication.instance().aboutToQuit.connect(self.__stopScan)
+
+    def __len__(self): return len(self.items)
+    def __getitem__(self, i): return self.items[i][1]
+
+    # it must not signal once the index is gone
+    def __stopScan(self):
+        self.quitting.set()
+        self.scan.join()
+
+    # a chunk is merged at a time, to not re-sort the whole list for every file; doubling them keeps
+    # the total of the merges linear in the files.
+    def __scan(self, path, key, exts):
+        (first, size, chunk) = (os.path.basename(path), 64, [])
+        try:
+            with os.scandir(os.path.dirname(path) or os.curdir) as it:
+                for f in it:
+                    if self.quitting.is_set():
+                        return
+                    if f.name == first or f.name.rpartition('.')[2].lower() not in exts:
+                        continue
+                    try:
+                        if not f.is_file():
+                            continue
+                        chunk.append((key(f.name, f.stat), f.path))
+                    except OSError:  # e.g., it's just been deleted; the rest are listed anyway
+                        continue
+                    if len(chunk) == size:
+                        self.__chunk.emit(chunk)
+                        (size, chunk) = (size * 2, [])
+        except OSError as e:
+            print(e, file=sys.stderr)
+        if chunk:
+            self.__chunk.emit(chunk)
+
+    def __merge(self, chunk):
+        chunk.sort()
+        old = self.items
+        self.items = sorted(old + chunk)  # two sorted runs; merged in linear time
+        self.grown.emit(lambda i: i + bisect.bisect(chunk, old[i]))
+
+
+# A changed PDF is reloaded only once it's been the same (in size and mtime) for this long, as it's
+# often written several times in a row (e.g., by LaTeX).
+RELOAD_DELAY_MS = 250
+
+def revision(path):
+    try:
+        st = os.stat(path)
+        return (st.st_size, st.st_mtime_ns)
+    except OSError:  # e.g., being replaced
+        return None
+
 
 class Pages(QWidget):
 
     fileChanged = pyqtSignal()
+    pageReady = pyqtSignal(QPixmap)  # the current page, when rendered in the background
+    listChanged = pyqtSignal()  # more images are found
+    __counted = pyqtSignal(int, object)         # (generation, (title, page count)); from a thread
+    __fingerprinted = pyqtSignal(int, object)   # (generation, fingerprints); from a thread
+    __reloaded = pyqtSignal(object, object)     # (revision, (backend, info, fingerprints)); from a thread
 
-    def __init__(self, first, *rest):
+    def __init__(self, first, *rest, sort=None):
         super().__init__()
         self.page = 0
         self.title = None
         self.invert = None
-        self.invert_but_no_mutool = lambda: self.invert and not mutool
-        # This being true implies that:
-        #   the outfile extension is 'pgm' not 'ppm'; and
-        #   the outfile is not inverted, although it's only grayscale instead.
+        self.cache = PageCache()
+        self.shown = None  # the pageidx (or the path, of images) of the pixmap last given to the viewer
+        self.shownDim = 0  # and its longdim
+        serial = len(rest) == 0 and first.lower().endswith('.pdf') and getattr(PdfBackend, 'serial', False)
+        self.scheduler = RenderScheduler(1 if serial else THREADS)  # of this window; they share the pools
+        self.saver = RenderScheduler()  # of the disk saves, not to be cancelled with the renders
+        self.generation = 0  # bumped on file changes, to ignore the renders of the old file
+        self.wanted = 0  # the longdim last requested for the current page
+        self.prefetcher = Prefetcher()
+        QCoreApplication.instance().aboutToQuit.connect(
+                lambda: report('prefetch of ' + first, self.prefetcher.stats()))
         if len(rest) == 0 and first.lower().endswith('.pdf'):
             self.mode = 'PDF'  # pdf reader mode
             self.invert = DEFAULT_INVERT
             self.trim = DEFAULT_TRIM
             self.opacity = DEFAULT_OPACITY
             self.pdfpath = first
-            self.ext = lambda: 'pgm' if self.invert_but_no_mutool() else 'ppm'
-            self.__dir = tempfile.TemporaryDirectory()
-            (self.origtitle, self.length) = self.__pdfInfo()
-            self.__getPage = lambda longdim: self.__getPdfPage(self.page, longdim)
-            self.dim = [0] * self.length
-            self.inv = [DEFAULT_INVERT] * self.length
-            self.toPrefetch = 1
+            self.backend = PdfBackend(self.pdfpath)
+            self.revision = self.pending = revision(self.pdfpath)
+            self.crops = CropBoxes(self.pdfpath, self.revision)
+            self.disk = DiskCache(self.pdfpath)
+            self.renderTime = 0  # of the last page rendered, in seconds
+            self.loadTime = None  # of the last page loaded from disk, in seconds; None until timed
+            self.scheduler.done.connect(self.__rendered)
+            self.saver.done.connect(self.__saved)
+            self.__getPage = lambda longdim: self.__getPdfPage(self.page, renderSize(longdim))
+            QCoreApplication.instance().aboutToQuit.connect(self.crops.save)
+            QCoreApplication.instance().aboutToQuit.connect(
+                    lambda: report('page cache of ' + self.pdfpath, self.cache.stats()))
+            QCoreApplication.instance().aboutToQuit.connect(
+                    lambda: report('disk cache of ' + self.pdfpath, self.disk.stats()))
+            self.hist = History()
+            # the title, page count, and fingerprints are kept in the history for each revision;
+            # otherwise, they're found in the background, and meanwhile the remembered page is rendered
+            # as if it exists.
+            meta = self.hist.meta(self.__histKey())
+            self.counted = self.revision is not None and meta.get('revision') == list(self.revision)
+            if self.counted:
+                (self.origtitle, self.length) = (meta['title'], meta['pages'])
+            else:
+                (self.origtitle, self.length) = (self.__pdfTitle(None), sys.maxsize)
             self.readHist()
-            # monitoring file changes
-            self.watcher = QFileSystemWatcher([first])
-            def changed():
-                (self.origtitle, self.length) = self.__pdfInfo()
-                for page in range(self.length):
-                    file = os.path.join(self.__dir.name, f"{page}.{self.ext()}")
-                    if os.path.exists(file):
-                        os.unlink(file)
-                self.fileChanged.emit()
-            self.watcher.fileChanged.connect(changed)
+            # of the pages of the loaded revision, when found
+            self.fingerprints = ([bytes.fromhex(p) for p in meta['fingerprints']]
+                                 if self.counted and 'fingerprints' in meta else None)
+            (self.inspections, self.quitting) = ([], threading.Event())
+            QCoreApplication.instance().aboutToQuit.connect(self.__stopInspecting)
+            self.__counted.connect(self.__setInfo)
+            self.__fingerprinted.connect(self.__setFingerprints)
+            backend = self.backend
+            def inspect():
+                if not self.counted:
+                    self.__counted.emit(0, self.__pdfInfo(backend))
+                self.__fingerprinted.emit(0, backend.fingerprints(self.quitting))
+            if self.fingerprints is None:
+                self.__inspect(inspect)
+            # monitoring file changes; the directory too, as replacing the file (by renaming another
+            # over it, as many editors save) drops it from the watcher.
+            self.__reloaded.connect(self.__reload)
+            self.reloadTimer = QTimer()
+            self.reloadTimer.setSingleShot(True)
+            self.reloadTimer.setInterval(RELOAD_DELAY_MS)
+            self.reloadTimer.timeout.connect(self.__changed)
+            self.watcher = QFileSystemWatcher([first, os.path.dirname(os.path.abspath(first))])
+            self.watcher.fileChanged.connect(self.reloadTimer.start)
+            self.watcher.directoryChanged.connect(self.reloadTimer.start)
         else:
             self.mode = 'Images'  # image viewer mode
             self.opacity = MAX_OPACITY
-            self.pages = [first, *rest]
+            self.pages = ImageIndex([first, *rest], sort)
+            self.pages.grown.connect(self.__grown)
             self.length = len(self.pages)
-            self.__getPage = lambda _: self.__getImg(self.pages[self.page])
-            self.__load(0, 1, 1024)
+            self.scheduler.done.connect(self.__decoded)
+            self.__getPage = lambda longdim: self.__getImgPage(self.page, renderSize(longdim))
 
     def __getTitle(self):
-        suf = " ({}/{})".format(self.page + 1, self.length)
+        suf = " ({}/{})".format(self.page + 1, self.length if self.mode == 'Images' or self.counted else '?')
         if self.mode == 'Images':
             return os.path.basename(self.pages[self.page]) + suf
         else:  # PDF
             return self.origtitle + suf
 
-    def __load(self, page, toPrefetch, *a):
+    def __load(self, page, *a):
         self.page = page % self.length
-        self.toPrefetch = toPrefetch % self.length
         self.title = self.__getTitle()
         return self.__getPage(*a)
 
     def getPage(self, *a):
-        return self.__load(self.page, self.toPrefetch, *a)
+        return self.__load(self.page, *a)
 
-    def next(self, *a): return self.__load(self.page + 1, self.page + 2, *a)
-    def prev(self, *a): return self.__load(self.page - 1, self.page - 2, *a)
+    def next(self, *a): self.prefetcher.turned(+1); return self.__load(self.page + 1, *a)
+    def prev(self, *a): self.prefetcher.turned(-1); return self.__load(self.page - 1, *a)
 
+    # the pages to prefetch, nearest first
+    def toPrefetch(self):
+        ahead = (self.page + self.prefetcher.direction * i for i in range(1, self.prefetcher.ahead(self.wanted) + 1))
+        return list(dict.fromkeys(p % self.length for p in ahead if p % self.length != self.page))
+
+    # queued in order, as the jobs of the same priority are run first come first served
     def prefetch(self):
-        if self.mode == 'PDF':
-            self.__getPdfPage(self.toPrefetch, self.dim[self.page])
-
-    def __getImg(self, path):
-        # https://doc.qt.io/qt-5/qtwidgets-widgets-imageviewer-example.html
-        reader = QImageReader(path)
-        reader.setAutoTransform(True)
-        newimg = reader.read()
-        if newimg == QImage():
-            # TODO: show this error msg on the window
-            print("Cannot load {}: {}".format(
-                QDir.toNativeSeparators(path), reader.errorString()), file=sys.stderr)
-        if self.invert_but_no_mutool():  # the user wants it inverted, but it's not
-            newimg.invertPixels()
-        return QPixmap.fromImage(newimg)
+        queued = {key[:2] for key in self.scheduler.jobs}  # (generation, page); not to look them up again
+        for pageidx in self.toPrefetch():
+            if self.mode == 'PDF':
+                if (self.generation, pageidx) not in queued:
+                    self.__getPdfPage(pageidx, self.wanted, PRIORITY_PREFETCH)
+            else:  # Images
+                if (self.generation, self.pages[pageidx]) not in queued:
+                    self.__getImgPage(pageidx, self.wanted, PRIORITY_PREFETCH)
+
+    # drops the queued renders that the user has already turned past
+    def __cancelStale(self, wanted):
+        self.prefetcher.cancelled(key[1] for key in self.scheduler.cancel(keep=lambda key: key[1] in wanted))
+
+    # the current image at a bigger size than the viewer, to zoom into it; prefetching is not affected.
+    def getZoomed(self, longdim):
+        return self.__getImgPage(self.page, renderSize(longdim), zoomed=True)
+
+    # returns the image if it's cached; otherwise decodes it in the background (at no more than
+    # longdim), and the current image is delivered by the pageReady signal.
+    # images are keyed by their paths, as their indices change when more of them are found.
+    def __getImgPage(self, pageidx, longdim, priority=PRIORITY_VISIBLE, zoomed=False):
+        path = self.pages[pageidx % self.length]
+        if priority == PRIORITY_VISIBLE and not zoomed:
+            self.wanted = longdim
+        img = self.cache.get(path, longdim)
+        if priority == PRIORITY_VISIBLE and not zoomed:
+            self.prefetcher.shown(path, img is not None)
+        if img is not None:
+            if priority == PRIORITY_VISIBLE:
+                return self.__show(path, longdim, img)
+            return
+        self.__cancelStale({self.pages[p] for p in (self.page, *self.toPrefetch())})
+        if priority == PRIORITY_PREFETCH:
+            self.prefetcher.submitted(path)
+        def work():
+            with span('decode', path):
+                return readImage(path, longdim)
+        self.scheduler.submit((self.generation, path, longdim), work, priority)
+        if priority == PRIORITY_VISIBLE:  # show it at a lower size meanwhile, if it's cached
+            (smalldim, small) = self.cache.biggest(path)
+            if small is not None:
+                return self.__show(path, smalldim, small)
+
+    def __decoded(self, key, result):
+        (generation, path, longdim) = key
+        (img, whole) = result or (QImage(), True)
+        current = path == self.pages[self.page]
+        if img.isNull():  # the error is printed; the image is shown empty
+            if current:
+                self.pageReady.emit(self.__show(path, 0, img))
+            return
+        if whole:  # it's as big as it gets; so it's good for any size
+            longdim = math.inf
+        self.cache.put((path, longdim), img)
+        self.prefetcher.rendered(path)
+        if current and not (path == self.shown and longdim <= self.shownDim):
+            self.pageReady.emit(self.__show(path, longdim, img))
+
+    # the same image stays current; the next one is prefetched anew.
+    def __grown(self, reindex):
+        self.page = reindex(self.page)
+        self.length = len(self.pages)
+        self.title = self.__getTitle()
+        self.listChanged.emit()
 
     def lessOpaque(self):
         if self.mode == 'PDF':
@@ -141,86 +1230,317 @@ class Pages(QWidget):
     def toggleInvert(self): self.invert = not self.invert
     def toggleTrim(self):   self.trim   = not self.trim
 
-    def __getPdfPage(self, pageidx, longdim):
+    # returns the page if it's cached; otherwise renders it in the background,
+    # and the current page is delivered by the pageReady signal.
+    def __getPdfPage(self, pageidx, longdim, priority=PRIORITY_VISIBLE):
         pageidx %= self.length
-        outfile_base = os.path.join(self.__dir.name, str(pageidx))
-        outfile = outfile_base + '.' + self.ext()
-        isdiff = self.dim[pageidx] < longdim or self.inv[pageidx] != self.invert
-        if not os.path.exists(outfile) or isdiff:
-            self.dim[pageidx] = longdim
-            self.inv[pageidx] = self.invert
-            subprocess.run(
-                render(longdim, self.invert, outfile, outfile_base, self.pdfpath, pageidx),
-                stderr=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
-        self.__reducepdfcache(5, 5)
-        return self.__getImg(outfile)
-
-    def __pdfInfo(self):
-        title = None
-        count = 0
-        for line in subprocess.run(['pdfinfo', self.pdfpath], capture_output=True).stdout.split(b'\n'):
-            if line.startswith(b'Title:'):
-                title = line.split(None, 1)[1].decode('utf-8')  # it's bytes
-            if line.startswith(b'Pages:'):
-                count = int(line.split()[1])
-        if title is None:
-            title = os.path.basename(self.pdfpath).split(os.path.extsep)[0]
-        return (title, count)
-
-    def __reducepdfcache(self, keepBefore, keepAfter):
-        if keepBefore + keepBefore >= self.length + 1:
+        if priority == PRIORITY_VISIBLE:
+            self.wanted = longdim
+        img = self.cache.get(pageidx, longdim)
+        if priority == PRIORITY_VISIBLE:
+            self.prefetcher.shown(pageidx, img is not None)
+        if img is not None:
+            if priority == PRIORITY_VISIBLE:
+                return self.__show(pageidx, longdim, img)
+            return
+        self.__cancelStale({self.page, *self.toPrefetch()})
+        ondisk = self.disk.find(pageidx, longdim) if self.__diskPays() else None
+        if priority != PRIORITY_VISIBLE:
+            self.prefetcher.submitted(pageidx)
+            return self.__render(pageidx, longdim, priority, ondisk)
+        # show something meanwhile: the page at a lower size if it's cached, or else a preview of it
+        # if rendering is slow (and it's not already being rendered, e.g., prefetched), which is
+        # submitted first to be rendered first.
+        (smalldim, small) = self.cache.biggest(pageidx)
+        rendering = self.scheduler.running((self.generation, pageidx, ondisk or longdim))
+        if small is None and ondisk is None and not rendering and self.renderTime > PREVIEW_AFTER:
+            self.__render(pageidx, max(1, int(longdim * PREVIEW_SCALE)), PRIORITY_PREVIEW, preview=True)
+        self.__render(pageidx, longdim, priority, ondisk)
+        if small is not None:
+            return self.__show(pageidx, smalldim, small)
+
+    # ondisk is the longdim of the page saved on disk, if any. Previews are not saved, nor timed,
+    # and their crop boxes are not found, as they'd be too coarse; nor are those of the others
+    # when not trimming, as they're then only needed if it's toggled (and found then, once).
+    def __render(self, pageidx, longdim, priority, ondisk=None, preview=False):
+        if ondisk is not None:
+            longdim = ondisk
+        (backend, disk) = (self.backend, self.disk)  # for the worker thread
+        needcrop = self.trim and pageidx not in self.crops and not preview
+        def work():
+            (img, seconds, loaded) = (QImage(), None, None)
+            if ondisk is not None:
+                start = time.monotonic()
+                with span('disk load', pageidx):
+                    img = disk.load(pageidx, longdim)
+                loaded = time.monotonic() - start if not img.isNull() else None
+            if img.isNull():
+                start = time.monotonic()
+                with span('preview' if preview else 'render', pageidx):
+                    img = backend.render(pageidx, longdim)
+                seconds = None if preview else time.monotonic() - start
+            # the crop box is found here, once, to cost nothing on the GUI thread when trimming;
+            # it's given as (box,) if found, as the box itself may be None.
+            crop = ()
+            if needcrop and not img.isNull():
+                with span('trim', pageidx):
+                    crop = (cropBox(img),)
+            return (img, crop, seconds, loaded)
+        self.scheduler.submit((self.generation, pageidx, longdim), work, priority)
+
+    # the disk cache is only used if loading a page is faster than rendering it, which it's not
+    # with the in-process backend; until both are timed, it's assumed to be.
+    def __diskPays(self):
+        return self.loadTime is None or not self.renderTime or self.renderTime > self.loadTime
+
+    # after the page is delivered, in the background; the first save is loaded back, to time it.
+    def __save(self, pageidx, longdim, img):
+        (disk, timeload) = (self.disk, self.loadTime is None)
+        def work():
+            with span('disk save', pageidx):
+                if not disk.save(pageidx, longdim, img):
+                    return None
+            if not timeload:
+                return (None,)
+            start = time.monotonic()
+            loaded = not disk.load(pageidx, longdim).isNull()
+            return (time.monotonic() - start if loaded else None,)
+        self.saver.submit((self.generation, pageidx, longdim), work, PRIORITY_SAVE)
+
+    def __saved(self, key, result):
+        (generation, pageidx, longdim) = key
+        if generation != self.generation or result is None:
+            return
+        self.disk.add(pageidx, longdim)
+        if result[0] is not None:
+            self.loadTime = result[0]
+
+    def __rendered(self, key, result):
+        (generation, pageidx, longdim) = key
+        (img, crop, seconds, loaded) = result or (QImage(), (), None, None)
+        if generation != self.generation:  # the file has changed since
+            return
+        if seconds is not None:
+            self.renderTime = seconds
+        if loaded is not None:
+            self.loadTime = loaded
+        if img.isNull():
+            if self.counted:  # otherwise, it may be past the end
+                # TODO: show this error msg on the window
+                print("Cannot render page {} of {}".format(
+                    pageidx + 1, QDir.toNativeSeparators(self.pdfpath)), file=sys.stderr)
+            return
+        self.cache.put((pageidx, longdim), img)
+        self.prefetcher.rendered(pageidx)
+        if seconds is not None and self.disk.enabled and self.__diskPays():
+            self.__save(pageidx, longdim, img)
+        if crop and pageidx not in self.crops:
+            self.crops[pageidx] = crop[0]
+        # unless a sharper one is already shown (e.g., this is a preview that came late)
+        if pageidx == self.page and not (pageidx == self.shown and longdim <= self.shownDim):
+            self.pageReady.emit(self.__show(pageidx, longdim, img))
+
+    def __show(self, pageidx, longdim, img):
+        (self.shown, self.shownDim) = (pageidx, longdim)
+        return self.__toPixmap(img)
+
+    def __toPixmap(self, img):
+        with span('pixmap'):
+            return QPixmap.fromImage(nightMode(img) if self.invert else img)
+
+    # of the page last given to the viewer, which is pix; it's found here only if it's not yet,
+    # and only kept if pix is not a preview or a smaller one, nor of the file before it's reloaded.
+    def cropBox(self, pix):
+        if self.shown in self.crops:
+            return self.crops[self.shown]
+        with span('trim'):
+            box = cropBox(pix)
+        if self.shown is not None and self.shownDim >= self.wanted:
+            self.crops[self.shown] = box
+        return box
+
+    def __pdfInfo(self, backend):
+        (title, count) = backend.info()
+        return (self.__pdfTitle(title), count)
+
+    def __pdfTitle(self, title):
+        return title if title is not None else os.path.basename(self.pdfpath).split(os.path.extsep)[0]
+
+    # the title and page count of the current revision, once found; kept for opening it again.
+    def __setInfo(self, generation, info):
+        if generation != self.generation:
+            return
+        page = self.page
+        (self.origtitle, self.length) = info
+        self.length = max(1, self.length)  # an unreadable file is shown as one blank page
+        self.counted = True
+        self.page = max(0, min(self.page, self.length - 1))
+        self.title = self.__getTitle()
+        self.__saveMeta()
+        started('page count')
+        self.fileChanged.emit() if self.page != page else self.listChanged.emit()
+
+    # RELOADING
+
+    # the file is looked at (once it's stable), then a new backend reads it off the GUI thread,
+    # and the pages whose fingerprints changed are dropped; the others are kept as they are.
+    # On quitting, they're stopped and waited for, as they must not signal once the window is gone.
+    def __inspect(self, work):
+        thread = threading.Thread(target=work, daemon=True)
+        self.inspections = [t for t in self.inspections if t.is_alive()] + [thread]
+        thread.start()
+
+    def __stopInspecting(self):
+        self.quitting.set()
+        for thread in self.inspections:
+            thread.join()
+
+    def __changed(self):
+        if self.pdfpath not in self.watcher.files():
+            self.watcher.addPath(self.pdfpath)  # it's been replaced; fails if it's not back yet
+        rev = revision(self.pdfpath)
+        if rev != self.pending:  # still being written
+            self.pending = rev
+            self.reloadTimer.start()
+            return
+        if rev is None or rev == self.revision:  # it's gone, or it's another file in the directory
+            return
+        backend = PdfBackend(self.pdfpath)
+        def inspect():
+            try:
+                result = (backend, self.__pdfInfo(backend), backend.fingerprints(self.quitting))
+            except Exception as e:
+                print("Cannot reload {}: {}".format(self.pdfpath, e), file=sys.stderr)
+                result = None
+            self.__reloaded.emit(rev, result)
+        self.__inspect(inspect)
+
+    def __setFingerprints(self, generation, prints):
+        if generation == self.generation:
+            self.fingerprints = prints
+            self.__saveMeta()
+
+    # what's found of the current revision: its title and page count, and its fingerprints if known
+    # (they take a while to find, as every page is read).
+    def __saveMeta(self):
+        if self.revision is None or not self.counted:  # e.g., the file doesn't exist
+            return
+        self.hist.setMeta(self.__histKey(), {
+            'revision': list(self.revision), 'title': self.origtitle, 'pages': self.length,
+            **({'fingerprints': [p.hex() for p in self.fingerprints]} if self.fingerprints is not None else {}),
+        })
+
+    # the revision is only taken once it's read; if it can't be, it's tried again later.
+    def __reload(self, rev, result):
+        if rev != self.pending or rev == self.revision:  # it's changed again since, or it's been read
+            return
+        if result is None:
+            self.reloadTimer.start()
             return
-        for page in range(self.page + keepAfter + 1,  self.page - keepBefore + self.length):
-            file = os.path.join(self.__dir.name, f"{page % self.length}.{self.ext()}")
-            if os.path.exists(file):
-                os.unlink(file)
+        self.revision = rev
+        (backend, info, prints) = result
+        old = self.fingerprints
+        if old is None or prints is None:
+            keep = set()
+        else:
+            keep = {i for (i, (a, b)) in enumerate(zip(old, prints)) if a == b}
+        self.generation += 1
+        self.scheduler.cancel()
+        self.saver.cancel()
+        self.backend = backend
+        self.fingerprints = prints
+        self.__setInfo(self.generation, info)
+        self.cache.clear(keep)
+        self.crops.invalidate(rev, keep)
+        self.disk = self.disk.renew(self.pdfpath, keep)
+        self.shown = None
+        report('reload of ' + self.pdfpath, {'pages': self.length, 'kept': len(keep)})
+        self.fileChanged.emit()
 
     # HISTORY
 
-    def __getConfigAndSectionName(self):
-        config = configparser.RawConfigParser(empty_lines_in_values=False)
-        section = os.path.abspath(self.pdfpath).replace('[', '_').replace(']', '_').replace('\n', '_')
+    def __histKey(self):
         # yes, I want the POSIX behavior of treating 'a/../b' as 'b' as if symlinks were not invented,
         # not the more correct behavior of pathlib.
-        config.read(HIST_INI)
-        return (config, section)
+        return os.path.abspath(self.pdfpath)
 
     def readHist(self):
-        (config, section) = self.__getConfigAndSectionName()
-        if section not in config:
-            return
-        this = config[section]
-        self.page = this.getint('page', self.page)
-        self.invert = this.getboolean('invert', self.invert)
-        self.trim = this.getboolean('trim', self.trim)
-        self.opacity = this.getint('opacity', self.opacity)
+        self.saved = self.hist.get(self.__histKey())
+        self.page = self.saved.get('page', self.page)
+        self.invert = self.saved.get('invert', self.invert)
+        self.trim = self.saved.get('trim', self.trim)
+        self.opacity = self.saved.get('opacity', self.opacity)
         #
         if self.page >= self.length:
             self.page = self.length - 1
         if self.page < 0:
             self.page = 0
-        self.toPrefetch = (self.page + 1) % self.length
 
     def writeHist(self):
         if self.mode != 'PDF':
             return
-        (config, section) = self.__getConfigAndSectionName()
-        existed = section in config
-        old = dict(config[section]) if existed else None
-        config[section] = {
-                'page':    self.page,
+        this = {
+            **({'page':    self.page}    if self.page    != 0               else {}),
             **({'invert':  self.invert}  if self.invert  != DEFAULT_INVERT  else {}),
             **({'trim':    self.trim}    if self.trim    != DEFAULT_TRIM    else {}),
             **({'opacity': self.opacity} if self.opacity != DEFAULT_OPACITY else {}),
         }
-        if dict(config[section]) == {'page': '0'}:  # there is nothing to save
-            del config[section]
-            dirty = existed  # to delete the history
-        else:  # there is something to save
-            dirty = dict(config[section]) != old
-        if dirty:
-            with open(HIST_INI, 'w') as configfile:
-                config.write(configfile)
+        if this != self.saved:
+            self.hist.put(self.__histKey(), this)
+            self.saved = this
+
+
+# An image for zooming and panning into: a pyramid of it, halved again and again, and the tiles of it
+# at the current zoom. Only the tiles in view are made, each scaled from the level of the pyramid closest
+# above the zoom, and they're kept while panning at the same zoom. So a frame costs about as much as
+# the viewport, not the zoomed image.
+class TiledImage:
+
+    TILE = 256
+
+    def __init__(self, pix):
+        self.levels = [pix]
+        self.zoom = None
+        self.tiles = {}  # (tx, ty) -> QPixmap, at self.zoom
+
+    def __level(self, k):
+        while len(self.levels) <= k:
+            last = self.levels[-1]
+            self.levels.append(last.scaled(max(1, last.width()//2), max(1, last.height()//2),
+                                           Qt.IgnoreAspectRatio, Qt.SmoothTransformation))
+        return self.levels[k]
+
+    def __tile(self, tx, ty):
+        T = self.TILE
+        k = max(0, math.floor(math.log2(1 / self.zoom)))  # the level is 1/2**k of the image
+        level = self.__level(k)
+        (fx, fy) = (self.zoom * self.levels[0].width()  / level.width(),
+                    self.zoom * self.levels[0].height() / level.height())
+        tile = QPixmap(T, T)
+        tile.fill(Qt.transparent)
+        painter = QPainter(tile)
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        painter.drawPixmap(QRectF(0, 0, T, T), level, QRectF(tx*T/fx, ty*T/fy, T/fx, T/fy))
+        painter.end()
+        return tile
+
+    # the rect (in the image scaled by zoom) as a pixmap
+    def view(self, zoom, rect):
+        if rect.isEmpty():
+            return QPixmap()
+        if zoom != self.zoom:
+            (self.zoom, self.tiles) = (zoom, {})
+        T = self.TILE
+        inview = [(tx, ty) for ty in range(rect.top()  // T, rect.bottom() // T + 1)
+                           for tx in range(rect.left() // T, rect.right()  // T + 1)]
+        self.tiles = {t: self.tiles.get(t) or self.__tile(*t) for t in inview}  # drop the rest
+        out = QPixmap(rect.size())
+        out.fill(Qt.transparent)
+        painter = QPainter(out)
+        for ((tx, ty), tile) in self.tiles.items():
+            painter.drawPixmap(tx*T - rect.left(), ty*T - rect.top(), tile)
+        painter.end()
+        return out
 
 
 class TouchViewer(QWidget):
@@ -240,10 +1560,20 @@ class TouchViewer(QWidget):
         self.initUI()
         #
         self.pages.fileChanged.connect(self.draw)
+        self.pages.pageReady.connect(self.showPage)
+        self.pages.listChanged.connect(self.relisted)
         self.draw()
 
     def initUI(self):
         (self.x, self.y, self.f) = (0, 0, 1)
+        self.pix = None
+        self.shownPage = None
+        self.tiled = None  # of pix, in Images mode
+        #
+        self.resizeTimer = QTimer()
+        self.resizeTimer.setSingleShot(True)
+        self.resizeTimer.setInterval(RESIZE_DELAY_MS)
+        self.resizeTimer.timeout.connect(self.resized)
         #
         self.darkstyle = lambda opacity=None: """
                 * { background-color: rgba( 34,  34,  34, """ + \
@@ -283,6 +1613,14 @@ class TouchViewer(QWidget):
         self.box.addWidget(self.lbl)
         # self.box.addLayout(self.btns)
         self.setLayout(self.box)
+        #
+        if TRACE and TRACE.overlay:  # over the page, at the top left
+            self.overlay = QLabel(self)
+            self.overlay.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; "
+                                       "font-family: monospace; font-size: 9pt; padding: 4px")
+            self.overlay.setAttribute(Qt.WA_TransparentForMouseEvents)
+
+    def focus(self): self.pages.scheduler.focus()
 
     def updateStyle(self):
         self.setStyleSheet(self.darkstyle() if self.pages.invert else self.lightstyle())
@@ -294,16 +1632,33 @@ class TouchViewer(QWidget):
     def prev(self): self.setPage(self.pages.prev   (self.longdim()))
     def next(self): self.setPage(self.pages.next   (self.longdim()))
 
-    def longdim(self): return max(self.lbl.height(),  self.lbl.width())
+    def longdim(self):
+        if not self.isVisible():  # before the window is shown (maximized), the screen is a good guess
+            size = QApplication.primaryScreen().availableSize()
+            return max(size.height(), size.width())
+        return max(self.lbl.height(), self.lbl.width())
     def meandim(self): return    (self.lbl.height() + self.lbl.width()) / 2
 
+    # pix is None if the page is being rendered in the background; it comes later to showPage.
     def setPage(self, pix):
-        self.pix = pix
-        (self.x, self.y, self.f) = (0, 0, 1)
         self.setTitle(self.pages.title)
-        self.__redraw()
+        if pix is not None:
+            self.showPage(pix)
+        self.pages.prefetch()
+
+    def relisted(self):
+        self.setTitle(self.pages.title)
         self.pages.prefetch()
 
+    # the zoom is kept if it's the same page (e.g., sharper, or at another size)
+    def showPage(self, pix):
+        started('first page')
+        if self.pages.shown != self.shownPage:
+            (self.x, self.y, self.f) = (0, 0, 1)
+        self.shownPage = self.pages.shown
+        self.pix = pix
+        self.__redraw()
+
     # takes a QPixmap
     # returns 4 Nones if null image or the four corner pixels aren't the same color.
     # otherwise returns the QImage, the corner QColor, the width, and the height.
@@ -317,40 +1672,9 @@ class TouchViewer(QWidget):
         if clr != img.pixelColor(w-1,   0): return (None,) * 4
         return img, clr, w, h
 
-    def __getBoundingRectRatio(self, p, vmargin=0, hmargin=0):
-        (img, clr, w, h) = self.__getImageCornerColor(p)
-        if img is None: return
-        #
-        def chk(lr_or_tb, default, range1, range2):
-            ret = default
-            if lr_or_tb == 'lr':  # left or right
-                for i in range1:
-                    if any(img.pixelColor(i,j) != clr for j in range2): break
-                    else: ret = i
-            else:
-                for i in range1:
-                    if any(img.pixelColor(j,i) != clr for j in range2): break
-                    else: ret = i
-            return ret
-        #
-        top    = chk('tb', -1, range(     h//2    ), range(w))
-        bottom = chk('tb',  h, range(h-1, h//2, -1), range(w))
-        left   = chk('lr', -1, range(     w//2    ), range(top+1, bottom))
-        right  = chk('lr',  w, range(w-1, w//2, -1), range(top+1, bottom))
-        #
-        top    = max( top    - vmargin,  -1 )
-        bottom = min( bottom + vmargin,   h )
-        left   = max( left   - hmargin,  -1 )
-        right  = min( right  + hmargin,   w )
-        #
-        X = (left   + 1)
-        Y = (top    + 1)
-        W = (right  - X)
-        H = (bottom - Y)
-        # return QPixmap(img.copy(X, Y, W, H))
-        return tuple(e/w for e in (X, Y, W, H))
-
     def __redraw(self):
+        if self.pix is None:  # nothing is rendered yet
+            return
         lw = self.lbl.width()
         lh = self.lbl.height()
         #
@@ -358,38 +1682,86 @@ class TouchViewer(QWidget):
             return p.scaled(w, h, Qt.KeepAspectRatio, Qt.SmoothTransformation)
         #
         if self.pages.mode == 'Images':
+            if self.pix.isNull():  # cannot be loaded
+                self.lbl.setPixmap(self.pix)
+                return
             iw = min(10000, int(max(1, self.f) * lw))
             ih = min(10000, int(max(1, self.f) * lh))
             self.f = max(iw/lw, ih/lh)
             x = max(0, min(iw-lw, int(self.x * self.f)))
             y = max(0, min(ih-lh, int(self.y * self.f)))
             # https://forum.qt.io/topic/75233/fit-image-into-qlabel @md2012 with modifications
-            self.lbl.setPixmap(scale(self.pix, iw, ih).copy(x, y, lw, lh))
+            # (the image is fitted in iw*ih, and lw*lh of it at x,y is shown; only that part is scaled)
+            if self.tiled is None or self.tiled.levels[0] is not self.pix:
+                self.tiled = TiledImage(self.pix)
+            fitted = self.pix.size().scaled(iw, ih, Qt.KeepAspectRatio)
+            zoom = fitted.width() / self.pix.width()
+            inview = QRect(x, y, lw, lh).intersected(QRect(QPoint(0, 0), fitted))
+            with span('tiles'):
+                self.lbl.setPixmap(self.tiled.view(zoom, inview))
         elif self.pages.mode == 'PDF':  # ASSUMPTION: no other trimming is applied/required!
             iw = self.pix.width()
             ih = self.pix.height()
             if self.pages.trim:
-                small = scale(self.pix, iw//4, ih//4)
-                params = self.__getBoundingRectRatio(small, vmargin=20, hmargin=10)
+                params = self.pages.cropBox(self.pix)
                 if params:
                     params = tuple(int(e*iw) for e in params)
-                    p = scale(self.pix.copy(*params), lw, lh)
+                    with span('scale'):
+                        p = scale(self.pix.copy(*params), lw, lh)
             try: p
             except:
-                p = scale(self.pix, lw, lh)
+                with span('scale'):
+                    p = scale(self.pix, lw, lh)
             if self.pages.invert and self.pages.opacity < 255:
-                (img, clr, w, h) = self.__getImageCornerColor(p)
-                if clr is not None:  # the corner pixels all are the same color
-                    p.setMask(p.createHeuristicMask())
+                with span('mask'):
+                    (img, clr, w, h) = self.__getImageCornerColor(p)
+                    if clr is not None:  # the corner pixels all are the same color
+                        p.setMask(p.createHeuristicMask())
             self.lbl.setPixmap(p)
+        if TRACE:
+            self.__traceFrame()
+
+    def __traceFrame(self):
+        pages = self.pages
+        counters = {
+            'cache': pages.cache.stats(),
+            **({'disk': pages.disk.stats()} if pages.mode == 'PDF' else {}),
+            'prefetch': pages.prefetcher.stats(),
+            'queued': sum(not job.started for (job, _) in pages.scheduler.jobs.values()),
+            'running': pages.scheduler.pool.activeThreadCount(),
+            'memory': {'pages': PageCache.total, 'process': rss()},
+        }
+        TRACE.frame(pages.shown, counters)
+        if TRACE.overlay:
+            mb = lambda b: f"{b / 2**20:.0f} MB" if b is not None else '?'
+            self.overlay.setText('\n'.join(
+                [f"{stage:<10} {seconds * 1000:7.1f} ms" for (stage, seconds) in TRACE.last.items()] +
+                [f"queued {counters['queued']}, running {counters['running']}",
+                 f"cache {counters['cache']['hits']} hits, {counters['cache']['misses']} misses",
+                 f"pages {mb(PageCache.total)}, process {mb(counters['memory']['process'])}"]))
+            self.overlay.adjustSize()
+            self.overlay.raise_()
+
+    # the image at the zoomed size, if it's decoded smaller than that
+    def sharpen(self):
+        pix = self.pages.getZoomed(int(self.f * self.longdim()))
+        if pix is not None:
+            self.pix = pix
+            self.__redraw()
+
+    def resized(self):
+        pix = self.pages.getPage(self.longdim())
+        if pix is not None:
+            self.pix = pix
+        self.__redraw()
 
     def lessOpaque(self): self.pages.lessOpaque(); self.draw(); self.updateStyle()
     def moreOpaque(self): self.pages.moreOpaque(); self.draw(); self.updateStyle()
 
     def event(self, ev):
         if ev.type() == QEvent.Resize:
-            self.pix = self.pages.getPage(self.longdim())
-            self.__redraw()
+            self.__redraw()  # the current page, scaled, until it's gotten at the new size
+            self.resizeTimer.start()
         #
         elif ev.type() == QEvent.Gesture:
             pinch = ev.gesture(Qt.PinchGesture)
@@ -411,6 +1783,8 @@ class TouchViewer(QWidget):
                     self.x -= 0.5 * (pt.x() - ol.x())
                     self.y -= 0.5 * (pt.y() - ol.y())
                     self.__redraw()
+                if pinch.state() == Qt.GestureFinished:
+                    self.sharpen()
             elif swipe and swipe.state() == Qt.GestureFinished:
                 if   swipe.horizontalDirection() == QSwipeGesture.Right: self.prev()
                 elif swipe.horizontalDirection() == QSwipeGesture.Left:  self.next()
@@ -431,11 +1805,11 @@ class TouchViewer(QWidget):
 
 class Window(QMainWindow):
 
-    def __init__(self, pages, toggleCursor):
+    def __init__(self, pages, toggleCursor, sort=None):
         super().__init__()
         self.toggleCursor = toggleCursor
         setTitle = lambda t: self.setWindowTitle((t + ' - ' if t else '') + 'CuteView')
-        self.b = TouchViewer(Pages(*pages), setTitle=setTitle)
+        self.b = TouchViewer(Pages(*pages, sort=sort), setTitle=setTitle)
         self.setCentralWidget(self.b)
         #
         # self.setWindowFlags(Qt.FramelessWindowHint)
@@ -450,6 +1824,11 @@ class Window(QMainWindow):
     def closeEvent(self, ev):
         self.b.writeHist()
 
+    def changeEvent(self, ev):
+        super().changeEvent(ev)
+        if ev.type() == QEvent.ActivationChange and self.isActiveWindow():
+            self.b.focus()
+
     def keyReleaseEvent(self, ev):
         if ev.key() == Qt.Key_Q:
             if ev.modifiers() == Qt.ShiftModifier:
@@ -465,36 +1844,6 @@ class Window(QMainWindow):
         elif ev.key() == Qt.Key_T:           self.b.toggleTrim()
 
 
-app = QApplication(sys.argv)
-pages = sys.argv[1:]
-
-if not pages:
-    imgexts = ' *.'+(' *.'.join(['png', 'jpg', 'gif', 'bmp', 'webp', 'svg', 'svgz']))
-    pages = QFileDialog.getOpenFileNames(None, "Open Images or PDF files", "",
-             ";;".join([
-                 "All Supported Files (*.pdf " + imgexts + ")",
-                 "Image Files (" + imgexts + ")",
-                 "PDF Files (*.pdf)",
-                 "All Files (*.*)",
-             ])
-         )[0]
-    if not pages:  # cancelled
-        sys.exit(0)
-
-imgs = []
-pdfs = []
-for f in pages:
-    pdfs.append(f) if f.lower().endswith('.pdf') else imgs.append(f)
-
-
-if pdfs and not poppler:
-    QMessageBox().critical(None, "poppler-tools not found",
-           "The package 'poppler-tools' is required for viewing PDF files, but it is not found.")
-    pdfs = []
-    if not imgs:
-        sys.exit(1)
-
-
 # based with mods on answer by shungo on
 # https://forum.qt.io/topic/28703/how-to-hide-the-cursor-in-qt5
 def hideCursor():
@@ -510,15 +1859,75 @@ def toggleCursor():
     showCursor() if __cursorHidden else hideCursor()
     __cursorHidden = not __cursorHidden
 
-toggleCursor()  # TODO: make it only hide after a timeout of inactivity
 
+def main(argv=sys.argv):
+    app = QApplication(argv)
+    started('application')
+    pages = argv[1:]
+
+    sort = None
+    for arg in [a for a in pages if a.startswith('--sort=')]:
+        sort = arg.split('=', 1)[1]
+        pages.remove(arg)
+    if sort is not None and sort not in IMAGE_SORTS:
+        print("cuteview: --sort must be one of: " + ', '.join(IMAGE_SORTS), file=sys.stderr)
+        sys.exit(2)
+
+    trace = os.environ.get('CUTEVIEW_TRACE')
+    for arg in [a for a in pages if a.startswith('--trace=')]:
+        trace = arg.split('=', 1)[1]
+        pages.remove(arg)
+    overlay = bool(os.environ.get('CUTEVIEW_OVERLAY')) or '--overlay' in pages
+    pages = [a for a in pages if a != '--overlay']
+    try:
+        startTrace(trace, overlay)
+    except OSError as e:
+        print("cuteview: cannot write the trace: " + str(e), file=sys.stderr)
+        sys.exit(2)
+
+    if not pages:
+        imgexts = ' *.'+(' *.'.join(['png', 'jpg', 'gif', 'bmp', 'webp', 'svg', 'svgz']))
+        pages = QFileDialog.getOpenFileNames(None, "Open Images or PDF files", "",
+                 ";;".join([
+                     "All Supported Files (*.pdf " + imgexts + ")",
+                     "Image Files (" + imgexts + ")",
+                     "PDF Files (*.pdf)",
+                     "All Files (*.*)",
+                 ])
+             )[0]
+        if not pages:  # cancelled
+            sys.exit(0)
+
+    imgs = []
+    pdfs = []
+    for f in pages:
+        pdfs.append(f) if f.lower().endswith('.pdf') else imgs.append(f)
+
+    if pdfs and PdfBackend is None:
+        QMessageBox().critical(None, "poppler-tools not found",
+               "Either the Python package 'PyMuPDF' or the package 'poppler-tools' is required "
+               "for viewing PDF files, but neither is found.")
+        pdfs = []
+        if not imgs:
+            sys.exit(1)
+
+    toggleCursor()  # TODO: make it only hide after a timeout of inactivity
+
+    w = []
+
+    if imgs:
+        w.append(Window(imgs, toggleCursor, sort))
+
+    for pdf in pdfs:
+        w.append(Window([pdf], toggleCursor))
+
+    started('windows')
 
-w = []
+    if pdfs and DISK_CACHE_BYTES:
+        app.aboutToQuit.connect(DiskCache.evict)  # after the windows' renders are stopped
 
-if imgs:
-    w.append(Window(imgs, toggleCursor))
+    return app.exec()
 
-for pdf in pdfs:
-    w.append(Window([pdf], toggleCursor))
 
-app.exit(app.exec())
+if __name__ == '__main__':
+    sys.exit(main())